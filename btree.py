@@ -1,21 +1,9 @@
 ﻿from __future__ import annotations
 from typing import Iterable, Optional, Union, List
-import bisect
-from collections.abc import MutableSequence
-from collections import Counter
-
-from abc import ABCMeta, abstractmethod
-from typing import Any, TypeVar
-
-'''
-Definition of a Comparable type
-link: https://www.python.org/dev/peps/pep-0484/#type-variables-with-an-upper-bound
-'''
-class Comparable(metaclass=ABCMeta):
-    @abstractmethod
-    def __lt__(self, other: Any) -> bool: ...
-
-CT = TypeVar('CT', bound=Comparable)
+from bisect import bisect_left
+from array import array
+from collections import deque
+from operator import attrgetter
 
 
 class Pair:
@@ -27,23 +15,17 @@ class Pair:
         self.val = val
 
     def __eq__(self, other):
+        if isinstance(other, Pair):
+            other = other.key
         return self.key == other
 
-    def __ne__(self, other):
-        return self.key != other
-
     def __lt__(self, other):
+        # The tree compares raw keys. This is only for sorting pairs outside
+        # of the tree.
+        if isinstance(other, Pair):
+            other = other.key
         return self.key < other
 
-    def __gt__(self, other):
-        return self.key > other
-
-    def __le__(self, other):
-        return self.key <= other
-
-    def __ge__(self, other):
-        return self.key >= other
-
     def __str__(self):
         return f'{{{self.key}: {self.val}}}'
 
@@ -51,68 +33,43 @@ class Pair:
         return self.__str__()
 
 
-class PairList(Pair, MutableSequence):
-
-    __slots__ = ('pairs',)
-
-    def __init__(self, key, pairs: List[Pair]):
-        if len(pairs) < 2:
-            raise ValueError
-        super().__init__(key, pairs)
-        self.pairs = self.val
-
-    def __getitem__(self, *args, **kwargs):
-        return self.pairs.__getitem__(*args, **kwargs)
-    
-    def __len__(self, *args, **kwargs):
-        return self.pairs.__len__(*args, **kwargs)
-    
-    def __setitem__(self, *args, **kwargs):
-        return self.pairs.__setitem__(*args, **kwargs)
-
-    def __delitem__(self, *args, **kwargs):
-        return self.pairs.__delitem__(*args, **kwargs)
-    
-    def __str__(self):
-        return f'{{{self.key}: {[pair.val for pair in self.pairs]}}}'
-
-    def insert(self, *args, **kwargs):
-        return self.pairs.insert(*args, **kwargs)
-
-    def is_valid(self):
-        return len(self.pairs) == len(
-            pair for pair in self.pairs if pair.key == self.key)
-    
-
 class Node:
 
-    __slots__ = ('__degree', '__max_pairs', '__min_pairs', 'pairs', 'children')
+    __slots__ = ('pairs', 'keys', 'children', 'is_leaf')
 
     def __init__(
         self,
-        degree,
         pairs: Optional[List[Pair]] = None,
         children: Optional[List[Union[None, Node]]] = None,
+        keys: Optional[List] = None,
     ):
-        self.__degree = degree
-        self.__max_pairs = (degree << 1) - 1
-        self.__min_pairs = degree - 1
-
         if pairs is None:
             self.pairs = []
         else:
             self.pairs = pairs
 
+        # The keys of the pairs are kept in a parallel list, so bisect can
+        # compare the raw keys without calling Pair.__lt__.
+        if keys is None:
+            self.keys = [pair.key for pair in self.pairs]
+        else:
+            self.keys = keys
+
         if children is None:
             self.children = [None]
         else:
             self.children = children
-            cnt = Counter(self.children)[None]
-            if cnt != len(self.children) and cnt != 0:
+            is_leaf = children[0] is None
+            if not all((child is None) == is_leaf for child in children):
                 raise ValueError
         if len(self.children) - len(self.pairs) != 1:
             raise ValueError
 
+        # For this implementation, if a node is not the leaf, all of its
+        # children must not be None. A node never changes between a leaf and
+        # an internal node, so this is set once here.
+        self.is_leaf = self.children[0] is None
+
     def __len__(self):
         return len(self.pairs)
 
@@ -122,28 +79,35 @@ class Node:
     def __repr__(self):
         return self.__str__()
 
-    def index(self, pair: Pair):
-        idx = bisect.bisect_left(self.pairs, pair)
-        if idx == len(self.pairs) or self.pairs[idx] != pair:
-            return idx, None
-        else:
-            return idx, self.pairs[idx]
+    def index(self, key):
+        '''return the index of the key and whether the key is in the node'''
+        keys = self.keys
+        idx = bisect_left(keys, key)
+        return idx, idx < len(keys) and keys[idx] == key
     
     def split_child(self, index):
         # The child that is split will be put at the right side
         right = self.children[index]
 
-        # get the middle pair
-        mid = right.__max_pairs >> 1
+        # get the middle pair. Only a full child is split, so the middle
+        # follows from its length and the node does not need the degree.
+        mid = len(right.pairs) >> 1
         mid_pair = right.pairs[mid]
 
         # split
-        left = Node(right.__degree, right.pairs[:mid], right.children[:mid+1])
-        right.pairs = right.pairs[mid+1:]
-        right.children = right.children[mid+1:]
+        left = Node(
+            right.pairs[:mid],
+            right.children[:mid+1],
+            right.keys[:mid],
+        )
+        # keep the right half in place instead of copying it
+        del right.pairs[:mid+1]
+        del right.keys[:mid+1]
+        del right.children[:mid+1]
 
         # link the parent and the children
         self.pairs.insert(index, mid_pair)
+        self.keys.insert(index, mid_pair.key)
         self.children.insert(index, left)
         self.children[index + 1] = right
 
@@ -155,110 +119,203 @@ class Node:
         # merge all pairs into the left child  
         left_child.pairs.append(self.pairs[index])
         left_child.pairs += right_child.pairs
+        left_child.keys.append(self.keys[index])
+        left_child.keys += right_child.keys
         left_child.children += right_child.children
 
         self.pairs.pop(index)
+        self.keys.pop(index)
         self.children.pop(index+1)
 
         return left_child
 
-    @property
-    def is_leaf(self):
-        # For this implementation, if a node is not the leaf, all of its 
-        # children must not be None
-        return self.children[0] is None
-
-    @property
-    def is_full(self):
-        return len(self.pairs) == self.__max_pairs
-
 
 class BTree:
-    def __init__(self, pairs: Optional[Iterable[Pair]] = None, degree=3):
+    def __init__(
+        self,
+        pairs: Optional[Iterable[Pair]] = None,
+        degree=3,
+        key_type: Optional[str] = None,
+        bulk=False,
+    ):
+        '''
+        key_type is a type code of the array module, e.g. 'q' for integer
+        keys. If it is given, the keys of each node are stored unboxed in an
+        array.array with that type code. Otherwise they are stored in a list
+        and may be any comparable objects.
+
+        If pairs are already sorted by key, or bulk is True, the tree is
+        built bottom-up from the sorted pairs instead of inserting them one
+        by one.
+        '''
         self.__node_max_pair = degree * 2 - 1
         self.__node_min_pair = degree - 1
-        self.__degree = degree
+        self.__key_type = key_type
         self.root = self.new_node()
+        # Whether the root holds the maximum number of pairs. It is updated
+        # wherever the root gains pairs or is replaced, so insert does not
+        # need to measure the root every time.
+        self._root_full = False
+        # Only the first pair of each key is stored in the tree. The pairs
+        # inserted later with the same key are kept here in insertion order.
+        # Keys only need to be hashable if they are inserted more than once,
+        # so every lookup is skipped while the dict is empty.
+        self._dupes = {}
         if pairs:
-            for pair in pairs:
-                self.insert(pair)
+            pairs = list(pairs)
+            if bulk:
+                pairs.sort(key=attrgetter('key'))
+            if bulk or all(
+                    not pairs[i+1].key < pairs[i].key
+                    for i in range(len(pairs) - 1)):
+                self._bulk_load(pairs)
+            else:
+                for pair in pairs:
+                    self.insert(pair)
+
+    def _bulk_load(self, pairs: List[Pair]):
+        '''build the tree from pairs sorted by key'''
+        level_pairs = []
+        for pair in pairs:
+            if level_pairs and level_pairs[-1].key == pair.key:
+                self._add_dupe(pair)
+            else:
+                level_pairs.append(pair)
+
+        # Build the tree level by level from the leaves. Each level is split
+        # into the fewest nodes that can hold it, and the children are spread
+        # evenly, so every node gets at least the minimum number of pairs.
+        # The pairs between two neighbouring nodes go up to the next level.
+        children = [None] * (len(level_pairs) + 1)
+        max_children = self.__node_max_pair + 1
+        while True:
+            child_cnt = len(children)
+            node_cnt = -(-child_cnt // max_children)
+            if node_cnt == 1:
+                self.root = self.new_node(level_pairs, children)
+                self._root_full = len(level_pairs) == self.__node_max_pair
+                return
+            size, extra = divmod(child_cnt, node_cnt)
+            nodes = []
+            parent_pairs = []
+            start = 0
+            for i in range(node_cnt):
+                stop = start + size + (i < extra)
+                nodes.append(self.new_node(
+                    level_pairs[start:stop-1], children[start:stop]))
+                if stop <= len(level_pairs):
+                    parent_pairs.append(level_pairs[stop-1])
+                start = stop
+            level_pairs, children = parent_pairs, nodes
 
     def __str__(self):
-        queue = []
+        queue = deque()
         res = []
-        queue.append((0, [], self.root))
+        queue.append((0, (), self.root))
         last_layer = 0
         while queue:
-            layer, path, node = queue.pop(0)
+            layer, path, node = queue.popleft()
             if last_layer != layer:
                 res.append('|')
                 last_layer = layer
             res.append(f'{layer}: ({", ".join(map(lambda p: str(p), path))}): {str(node)}')
             if not node.is_leaf:
                 for i in range(len(node.children)):
-                    queue.append((layer + 1, path + [i], node.children[i]))
+                    queue.append((layer + 1, (*path, i), node.children[i]))
         return '\n'.join(res)
 
     def __repr__(self):
         return self.__str__()
 
     def __iter__(self):
-        def yield_pair(pair):
-            if isinstance(pair, PairList):
-                yield from pair
+        dupes = self._dupes
+        # Each frame holds an internal node and the index of its next pair.
+        # The child on the left side of that pair has been visited already.
+        stack = []
+        node = self.root
+        while True:
+            while not node.is_leaf:
+                stack.append([node, 0])
+                node = node.children[0]
+            # Most trees hold no duplicate keys, so skip the per-pair lookup
+            # of the duplicates when there is none.
+            if dupes:
+                for pair in node.pairs:
+                    yield pair
+                    if pair.key in dupes:
+                        yield from dupes[pair.key]
             else:
-                yield pair
-
-        def dfs(node):
-            for i in range(len(node)):
-                if not node.is_leaf:
-                    yield from dfs(node.children[i])
-                yield from yield_pair(node.pairs[i])
-            if not node.is_leaf:
-                yield from dfs(node.children[len(node)])
-                
-        return dfs(self.root)
+                yield from node.pairs
+
+            while stack:
+                frame = stack[-1]
+                node, i = frame
+                if i < len(node.pairs):
+                    pair = node.pairs[i]
+                    yield pair
+                    if dupes and pair.key in dupes:
+                        yield from dupes[pair.key]
+                    frame[1] = i + 1
+                    node = node.children[i + 1]
+                    break
+                stack.pop()
+            else:
+                return
         
     def new_node(self, pairs=None, children=None):
-        return Node(self.__degree, pairs, children)
-
-    def _find_insert(self, key: Union[Pair, CT]):
-        if self.root.is_full:
+        keys = None
+        if self.__key_type is not None:
+            keys = array(
+                self.__key_type, [pair.key for pair in pairs or ()])
+        return Node(pairs, children, keys)
+
+    def _find_insert(self, key):
+        max_pairs = self.__node_max_pair
+        if self._root_full:
             # split root
-            new_root = self.new_node()
-            new_root.children[0] = self.root
+            new_root = self.new_node(children=[self.root])
             self.root = new_root
             self.root.split_child(0)
+            self._root_full = False
 
         cur_node = self.root
         while True:
-            index, target = cur_node.index(key)
-            if target is not None or cur_node.is_leaf:
-                return cur_node, index
-            if cur_node.children[index].is_full:
+            keys = cur_node.keys
+            index = bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                return cur_node, index, True
+            if cur_node.is_leaf:
+                return cur_node, index, False
+            child = cur_node.children[index]
+            if len(child.keys) == max_pairs:
                 cur_node.split_child(index)
-            else:               
-                cur_node = cur_node.children[index]
+                if cur_node is self.root:
+                    self._root_full = len(keys) == max_pairs
+                # search the node again for the pair moved up from the child
+                continue
+            cur_node = child
 
     def _find(self, key):
+        '''return the node containing the key and the index of the key'''
+        # Walk the keys lists directly instead of going through Node.index,
+        # so a lookup neither allocates a Pair nor makes a method call per
+        # level.
         cur_node = self.root
-        tmp_pair = Pair(key)
-        while True:
-            idx, target = cur_node.index(tmp_pair)
-            if target is not None:
-                return target 
-            if cur_node.children[idx] is None:
-                return None
+        while cur_node is not None:
+            keys = cur_node.keys
+            idx = bisect_left(keys, key)
+            if idx < len(keys) and keys[idx] == key:
+                return cur_node, idx
             cur_node = cur_node.children[idx]
+        return None, None
     
     def search_all(self, key, value_only=True):
-        match = self._find(key)
-        if match is None:
+        node, idx = self._find(key)
+        if node is None:
             return None
-        if not isinstance(match, PairList):
-            match = [match]
-        else:
-            match = match.pairs
+        match = [node.pairs[idx]]
+        if self._dupes:
+            match += self._dupes.get(key, ())
 
         if value_only:
             return [pair.val for pair in match]
@@ -266,105 +323,144 @@ class BTree:
             return match
                 
     def insert(self, pair: Pair):    
-        node, index = self._find_insert(pair)
-        if index < len(node.pairs) and node.pairs[index].key == pair.key:
-            successor = node.pairs[index]
-            if isinstance(successor, PairList):
-                successor.append(pair)
-            else:
-                node.pairs[index] = PairList(successor.key, [successor, pair])
+        node, index, found = self._find_insert(pair.key)
+        if found:
+            self._add_dupe(pair)
         else:
+            # Insert the key first. An array.array rejects a key it cannot
+            # hold, and the node must be left untouched in that case.
+            node.keys.insert(index, pair.key)
             node.pairs.insert(index, pair)
             node.children.insert(index, None)
+            if node is self.root:
+                self._root_full = len(node.keys) == self.__node_max_pair
         return
             
+    def _add_dupe(self, pair: Pair):
+        try:
+            dupes = self._dupes.setdefault(pair.key, [])
+        except TypeError:
+            raise TypeError(
+                f'duplicate keys must be hashable: {pair.key!r}') from None
+        dupes.append(pair)
+
     def _delete(self, node: Node, pair: Pair, ignore_id=False):
-        idx, target = node.index(pair)
-
-        if not ignore_id:
-            if isinstance(target, PairList):
-                found = False
-                for i in range(len(target)):
-                    if id(target[i]) == id(pair):
-                        target.pop(i)
-                        found = True
-                        break
-                if not found:
-                    raise ValueError
-                if len(target) <= 1:
-                    node.pairs[idx], = target
-                return
-            if target is not None:
-                if id(target) != id(pair):
+        # Single pass from the top down. Before going down to a child, make
+        # sure the child has more than the minimum number of pairs, so a
+        # pair can be removed from it without walking back up.
+        min_pairs = self.__node_min_pair
+        while True:
+            idx, found = node.index(pair.key)
+
+            if found:
+                if not ignore_id and id(node.pairs[idx]) != id(pair):
                     raise ValueError
-            
-        if target is not None:
+                if node.is_leaf:
+                    node.pairs.pop(idx)
+                    node.keys.pop(idx)
+                    node.children.pop(idx)
+                    return
+
+                left_child = node.children[idx]
+                right_child = node.children[idx+1]
+                if len(left_child) > min_pairs:
+                    ptr = left_child
+                    while not ptr.is_leaf:
+                        ptr = ptr.children[-1]
+                    predecessor = ptr.pairs[-1]
+                    # Deleting the predecessor only touches the left subtree,
+                    # so the pair can be replaced before going down.
+                    node.pairs[idx] = predecessor
+                    node.keys[idx] = predecessor.key
+                    node, pair = left_child, predecessor
+                elif len(right_child) > min_pairs:
+                    ptr = right_child
+                    while not ptr.is_leaf:
+                        ptr = ptr.children[0]
+                    successor = ptr.pairs[0]
+                    node.pairs[idx] = successor
+                    node.keys[idx] = successor.key
+                    node, pair = right_child, successor
+                else:
+                    node = node.merge_children(idx)
+                ignore_id = True
+                continue
+
             if node.is_leaf:
-                node.pairs.pop(idx)
-                node.children.pop(idx)
-                return
-            
-            left_child = node.children[idx]
-            right_child = node.children[idx+1]
-            if len(left_child) > self.__node_min_pair:
-                ptr = left_child
-                while not ptr.is_leaf:
-                    ptr = ptr.children[-1]
-                predecessor = ptr.pairs[-1]
-                self._delete(left_child, predecessor, ignore_id=True)
-                node.pairs[idx] = predecessor
-                return
-            elif len(right_child) > self.__node_min_pair:
-                ptr = right_child
-                while not ptr.is_leaf:
-                    ptr = ptr.children[0]
-                successor = ptr.pairs[0]
-                self._delete(right_child, successor, ignore_id=True)
-                node.pairs[idx] = successor
-                return
-            else:
-                node.merge_children(idx)
-                self._delete(left_child, pair, ignore_id=True)
+                # the pair is not in the tree
+                if not ignore_id:
+                    raise ValueError
                 return
-        else:
+
             next_child = node.children[idx]
-            if len(next_child) <= self.__node_min_pair:
+            if len(next_child) <= min_pairs:
                 go_next = False
                 if idx >= 1:
                     left_sibling = node.children[idx-1]
-                    if len(left_sibling) > self.__node_min_pair:
+                    if len(left_sibling) > min_pairs:
                         next_child.pairs.insert(0, node.pairs[idx-1])
+                        next_child.keys.insert(0, node.keys[idx-1])
                         next_child.children.insert(0, left_sibling.children.pop())
                         node.pairs[idx-1] = left_sibling.pairs.pop()
+                        node.keys[idx-1] = left_sibling.keys.pop()
                         go_next = True
                 if idx < len(node) and not go_next:
                     right_sibling = node.children[idx+1]
-                    if len(right_sibling) > self.__node_min_pair:
+                    if len(right_sibling) > min_pairs:
                         next_child.pairs.append(node.pairs[idx])
+                        next_child.keys.append(node.keys[idx])
                         next_child.children.append(right_sibling.children.pop(0))
                         node.pairs[idx] = right_sibling.pairs.pop(0)
+                        node.keys[idx] = right_sibling.keys.pop(0)
                         go_next = True
                 if not go_next:
                     if idx < len(node):
                         next_child = node.merge_children(idx)
                     elif idx >= 1:
                         next_child = node.merge_children(idx - 1)
-            self._delete(next_child, pair, ignore_id)
-                        
+            node = next_child
+
     def _kick_off_root(self):
         if len(self.root) == 0 and not self.root.is_leaf:
             self.root = self.root.children[0]
+        self._root_full = len(self.root.keys) == self.__node_max_pair
 
     def delete_one(self, pair: Pair):
-        self._delete(self.root, pair, ignore_id=False)
-        self._kick_off_root()
+        dupes = self._dupes.get(pair.key) if self._dupes else None
+        if dupes:
+            for i in range(len(dupes)):
+                if id(dupes[i]) == id(pair):
+                    dupes.pop(i)
+                    if not dupes:
+                        del self._dupes[pair.key]
+                    return
+            # The pair is the one stored in the tree. Replace it with the
+            # earliest duplicate, so the tree structure is untouched.
+            node, idx = self._find(pair.key)
+            if id(node.pairs[idx]) != id(pair):
+                raise ValueError
+            node.pairs[idx] = dupes.pop(0)
+            if not dupes:
+                del self._dupes[pair.key]
+            return
+        try:
+            self._delete(self.root, pair, ignore_id=False)
+        finally:
+            # The nodes on the path may have been merged even if the pair
+            # turns out to be missing.
+            self._kick_off_root()
 
     def delete(self, key):
+        if self._dupes:
+            self._dupes.pop(key, None)
         pair = Pair(key)
         self._delete(self.root, pair, ignore_id=True)
         self._kick_off_root()
 
     def is_valid(self):
+        if self._root_full != (len(self.root) == self.__node_max_pair):
+            return False
+
         def check_node(node, low, high):
             # empty tree
             if node == self.root and len(node) == 0:
@@ -377,32 +473,34 @@ class BTree:
                 return False
             if len(node.children) - len(node) != 1:
                 return False
+            if list(node.keys) != [pair.key for pair in node.pairs]:
+                return False
             
             # If a node is a leaf, all of its children must be None. On the
             # other hand, if a node is not a leaf, all of its children must
             # not be None.
-            none_cnt = Counter(node.children)[None]
-            if not node.is_leaf and none_cnt != 0:
+            is_leaf = node.children[0] is None
+            if node.is_leaf != is_leaf:
                 return False
-            if node.is_leaf and none_cnt != len(node) + 1:
+            if not all((child is None) == is_leaf for child in node.children):
                 return False
             
             # check the pairs are sorted
-            last_pair = node.pairs[0]
-            if low is not None and last_pair <= low:
+            last_key = node.keys[0]
+            if low is not None and not low < last_key:
                 return False
             for i in range(1, len(node)):
-                if node.pairs[i] < last_pair:
+                if not last_key < node.keys[i]:
                     return False
-                last_pair = node.pairs[i]
-            if high is not None and last_pair >= high:
+                last_key = node.keys[i]
+            if high is not None and not last_key < high:
                 return False
             
             # check other nodes with DFS
             if not node.is_leaf:
-                tmp_pairs = [low, *node.pairs, high]
+                tmp_keys = [low, *node.keys, high]
                 for i in range(len(node) + 1):
-                    if not check_node(node.children[i], tmp_pairs[i], tmp_pairs[i+1]):
+                    if not check_node(node.children[i], tmp_keys[i], tmp_keys[i+1]):
                         return False
             return True
             
@@ -3,19 +3,19 @@ from collections import OrderedDict
 from btree import Pair, BTree
 
 
-def test(pairs=None):
+def test(pairs=None, key_type=None):
     try:
         error_info = OrderedDict()
         if pairs is not None:
             pair_cnt = len(pairs)
             seq = pairs
-            b_tree = BTree(pairs)
+            b_tree = BTree(pairs, key_type=key_type)
             error_info['Insert sequence'] = seq
             error_info['Tree'] = b_tree
         else:
             pair_cnt = 200
             seq = []
-            b_tree = BTree()
+            b_tree = BTree(key_type=key_type)
             error_info['Insert sequence'] = seq
             error_info['Tree'] = b_tree
             for i in range(pair_cnt):
@@ -51,6 +51,113 @@ def test(pairs=None):
         e.args = (e.args[0] + f'\n{extra_msg}', *e.args[1:])
         raise e
 
+def test_sorted_pairs():
+    # sorted pairs are loaded bottom-up instead of being inserted one by one
+    pairs = sorted(
+        Pair(random.randint(1, 50), random.randint(1, 1000))
+        for i in range(200))
+    assert BTree(pairs).is_valid()
+    assert test(pairs)
+
+    # enough distinct keys for several internal levels
+    pairs = [Pair(random.randint(1, 2000), i) for i in range(1000)]
+    sorted_ids = [id(pair) for pair in sorted(pairs)]
+    for degree in (2, 3):
+        b_tree = BTree(pairs, degree=degree, bulk=True)
+        assert b_tree.is_valid()
+        height = 1
+        node = b_tree.root
+        while not node.is_leaf:
+            node = node.children[0]
+            height += 1
+        assert height >= 3
+        assert [id(pair) for pair in b_tree] == sorted_ids
+
+    # keys only need to support < and ==
+    class LtKey:
+        def __init__(self, val):
+            self.val = val
+
+        def __lt__(self, other):
+            return self.val < other.val
+
+        def __eq__(self, other):
+            return self.val == other.val
+
+    pairs = [Pair(LtKey(i)) for i in range(100)]
+    b_tree = BTree(pairs)
+    assert b_tree.is_valid()
+    assert [id(pair) for pair in b_tree] == [id(pair) for pair in pairs]
+
+def test_array_keys():
+    assert test(key_type='q')
+    pairs = sorted(
+        Pair(random.randint(1, 50), random.randint(1, 1000))
+        for i in range(200))
+    assert test(pairs, key_type='q')
+
+def test_array_keys_reject():
+    b_tree = BTree(key_type='q')
+    pairs = [Pair(i) for i in range(0, 40, 2)]
+    for pair in pairs:
+        b_tree.insert(pair)
+    for key in (1.5, 2**70, 'a'):
+        try:
+            b_tree.insert(Pair(key))
+        except (TypeError, OverflowError):
+            pass
+        else:
+            assert False, f'Key {key!r} should be rejected.'
+        assert b_tree.is_valid()
+        assert [id(pair) for pair in b_tree] == [id(pair) for pair in pairs]
+
+def test_unhashable_keys():
+    # keys only need to be hashable when they are duplicated
+    pairs = [Pair([i, i]) for i in range(100)]
+    random.shuffle(pairs)
+    b_tree = BTree()
+    for pair in pairs:
+        b_tree.insert(pair)
+    assert b_tree.search_all([3, 3], value_only=False)[0].key == [3, 3]
+    try:
+        b_tree.insert(Pair([3, 3]))
+    except TypeError:
+        pass
+    else:
+        assert False, 'Duplicate unhashable keys should be rejected.'
+    assert b_tree.is_valid()
+    assert [pair.key for pair in b_tree] == [[i, i] for i in range(100)]
+    for pair in pairs:
+        b_tree.delete_one(pair)
+        assert b_tree.is_valid()
+    assert len(b_tree.root) == 0
+
+def test_delete_missing():
+    b_tree = BTree(degree=2)
+    pairs = [Pair(i) for i in range(0, 100, 2)]
+    random.shuffle(pairs)
+    for pair in pairs:
+        b_tree.insert(pair)
+    sorted_ids = [id(pair) for pair in sorted(pairs)]
+
+    # deleting a missing key does nothing
+    for key in range(-1, 101, 2):
+        b_tree.delete(key)
+        assert b_tree.is_valid()
+        assert [id(pair) for pair in b_tree] == sorted_ids
+
+    # deleting a pair that is not in the tree raises ValueError, whether or
+    # not another pair with the same key is
+    for key in range(-1, 101):
+        try:
+            b_tree.delete_one(Pair(key))
+        except ValueError:
+            pass
+        else:
+            assert False, f'Deleting a foreign pair {key} should fail.'
+        assert b_tree.is_valid()
+        assert [id(pair) for pair in b_tree] == sorted_ids
+
 # helper function
 def str2pairs(s):
     return [Pair(k, v) for p in s for k, v in p.items()]   